@@ -0,0 +1,150 @@
+import os
+import time # To record when each cache entry was stored
+import asyncio # To share one in-flight fetch between requests asking for the same thing
+import orjson # Fast JSON library used to store cached values (several times faster than the built-in json module)
+import redis  # Redis client used to cache responses from external APIs (TMDB, OpenAI)
+import redis.asyncio as aioredis # Async version of the Redis client so cache lookups don't block the event loop
+
+# this is the cache.py file that holds the shared Redis connection and the helpers the service files use to cache data
+
+# ! Step 1: Read the Redis connection URL from the environment (falls back to a local Redis server)
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# ! Step 1.1: How long (in seconds) each kind of cached data stays valid
+CACHE_TTL_DETAILS = int(os.getenv("CACHE_TTL_DETAILS", 86400)) # Movie details rarely change, so keep them for 24 hours
+CACHE_TTL_SEARCH = int(os.getenv("CACHE_TTL_SEARCH", 900)) # Search results change more often, so only keep them for 15 minutes
+CACHE_TTL_CHAT = int(os.getenv("CACHE_TTL_CHAT", 3600)) # GPT answers are reused for 1 hour for the same question about the same movie
+CACHE_TTL_STALE = int(os.getenv("CACHE_TTL_STALE", 604800)) # Old entries are kept for 7 days so we can still answer when TMDB or OpenAI is down
+
+# ! Step 1.2: Create one Redis client for the whole process
+r = aioredis.Redis.from_url(REDIS_URL, decode_responses=True) # * decode_responses=True makes Redis give us back strings instead of bytes
+
+
+# ! Step 1.3: Fetches that are currently running, by cache key (see single_flight below)
+inflight = {}
+
+# ! Step 1.4: Background refreshes that are still running (we keep a reference so they aren't garbage collected mid-way)
+background_tasks = set()
+
+
+# ! Step 2: Define a function to read a cached value
+async def cache_get(key):
+    try:
+        cached = await r.get(key) # * look up the key in Redis, this returns None if the key does not exist or has expired
+    except redis.RedisError:
+        return None # If Redis is unreachable, behave as if nothing was cached so the app keeps working
+
+    if cached is None:
+        return None
+
+    return orjson.loads(cached) # * turn the stored JSON string back into a Python object
+
+
+# ! Step 3: Define a function to store a value for `ttl` seconds
+async def cache_set(key, value, ttl):
+    try:
+        await r.setex(key, ttl, orjson.dumps(value)) # * setex stores the value and sets its expiry time in one command
+    except redis.RedisError:
+        pass # Caching is best effort, a Redis failure should never break the request
+
+
+# ! Step 4: Define a function that makes sure only one fetch per key runs at a time
+# * when lots of requests miss the cache for the same key at once (e.g. right after it expires), only the first one calls the API,
+# * the others just wait for that same result instead of all hitting the API at the same time
+async def single_flight(key, fetch):
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch()) # Start the fetch in the background so every waiter can share it
+        inflight[key] = task
+        task.add_done_callback(lambda _: inflight.pop(key, None)) # Forget about it once it finishes so the next miss fetches again
+
+    return await asyncio.shield(task) # * shield means one waiter giving up (e.g. client disconnects) doesn't cancel the fetch for everyone else
+
+
+# * the functions below store entries as Redis hashes {"data": ..., "stored_at": timestamp, "etag": ...} and keep them for CACHE_TTL_STALE seconds,
+# * an entry is "fresh" for a shorter time (e.g. CACHE_TTL_DETAILS), after that it is "stale" but still usable as a fallback
+# * (a hash lets us update "stored_at" on its own, without sending the whole cached payload back to Redis)
+
+# ! Step 4.1: Returned by a fetch function when the API says the data hasn't changed (HTTP 304)
+NOT_MODIFIED = object()
+
+
+# ! Step 5: Define a function to read a cache entry together with the time it was stored
+async def cache_get_entry(key):
+    try:
+        fields = await r.hgetall(key)
+    except redis.RedisError:
+        return None # Redis is unreachable (or the key holds an old-format value), treat it as a miss
+
+    if "data" not in fields or "stored_at" not in fields:
+        return None # Nothing cached
+
+    return {"data": orjson.loads(fields["data"]), "stored_at": float(fields["stored_at"]), "etag": fields.get("etag")}
+
+
+# ! Step 6: Define a function to store a cache entry stamped with the current time
+async def cache_set_entry(key, data, etag=None):
+    mapping = {"data": orjson.dumps(data), "stored_at": time.time()}
+    if etag:
+        mapping["etag"] = etag # * the API's version tag for this data, sent back later to ask "has it changed?"
+
+    try:
+        async with r.pipeline(transaction=True) as pipe: # * run all three commands as one step so nobody sees a half-written entry
+            pipe.delete(key) # Clears out any old-format value stored under this key
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, CACHE_TTL_STALE)
+            await pipe.execute()
+    except redis.RedisError:
+        pass # Caching is best effort, a Redis failure should never break the request
+
+
+# ! Step 6.1: Define a function that marks an entry as fresh again without rewriting its data
+async def cache_touch_entry(key):
+    try:
+        async with r.pipeline(transaction=True) as pipe:
+            pipe.hset(key, "stored_at", time.time())
+            pipe.expire(key, CACHE_TTL_STALE)
+            await pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+# ! Step 7: Define a function that checks if an entry is still fresh
+def is_fresh(entry, fresh_ttl):
+    return time.time() - entry["stored_at"] < fresh_ttl
+
+
+# ! Step 8: Define a function that returns cached data, serving stale data right away while refreshing it in the background
+# * fetch(etag) must return (data, etag), (NOT_MODIFIED, etag) if the data behind `etag` hasn't changed, or None if it failed
+# * returns (data, stale, etag), data is None only if nothing is cached and fetch() failed
+async def cached_fetch(key, fresh_ttl, fetch):
+    # ! Step 8.1: Call the API and store the result if it worked
+    async def refresh(entry=None):
+        result = await fetch(entry["etag"] if entry else None) # * if we already have the data, tell the API which version we have
+        if result is None:
+            return None, None
+
+        data, etag = result
+        if data is NOT_MODIFIED:
+            await cache_touch_entry(key) # Nothing changed, just mark our copy as fresh again
+            return entry["data"], entry["etag"]
+
+        await cache_set_entry(key, data, etag)
+        return data, etag
+
+    entry = await cache_get_entry(key)
+
+    # ! Step 8.2: Fresh entry, just return it
+    if entry is not None and is_fresh(entry, fresh_ttl):
+        return entry["data"], False, entry["etag"]
+
+    # ! Step 8.3: Stale entry, return it now and refresh it in the background (if the refresh fails we simply keep the old entry)
+    if entry is not None:
+        task = asyncio.ensure_future(single_flight(key, lambda: refresh(entry)))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+        return entry["data"], True, entry["etag"]
+
+    # ! Step 8.4: Nothing cached, we have to wait for the API
+    data, etag = await single_flight(key, refresh)
+    return data, False, etag
@@ -1,50 +1,286 @@
 import os # Import necessary modules
-from openai import OpenAI # Import OpenAI library for GPT-3.5 interaction
+import asyncio # To run several GPT requests at the same time for the batch endpoint
+import hashlib # To turn the user's question into a short fixed-length cache key
+from functools import lru_cache # To create the OpenAI client only once, on first use
+import httpx # HTTP library used underneath the OpenAI client
+from openai import AsyncOpenAI, RateLimitError # Import the async OpenAI client so waiting for GPT doesn't block other requests
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential # To retry GPT requests that hit OpenAI's rate limit
 from movie_service import get_movie_details, search_movie # Import movie service functions
+from rate_limiter import acquire_token, get_openai_semaphore # Keeps us under OpenAI's rate limits
+from cache import cache_get, cache_set, cache_get_entry, cache_set_entry, is_fresh, CACHE_TTL_CHAT, CACHE_TTL_DETAILS # Redis cache helpers so repeated questions don't cost another OpenAI call
 
 # API key to access OpenAI 
 API_KEY = os.getenv("OPENAI_API_KEY") # put your own api key
 
-# Creates the OpenAI client using the key
-client = OpenAI(api_key=API_KEY)# * set API key for OpenAI library
+# Creates the OpenAI client using the key, the first time it is needed
+# * building it lazily keeps worker start-up fast and lets routes that don't use GPT (like /search_movie) work even without an OpenAI key,
+# * lru_cache makes every later call return the same client
+@lru_cache(maxsize=None)
+def get_client():
+    # * we build the httpx client ourselves so one connection pool is shared by every chat request in this process and it can handle lots of requests at once
+    openai_http_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=200, max_keepalive_connections=50), timeout=60)
+    # * max_retries=0 turns off the OpenAI library's own retries, our tenacity retry in send_to_openai is the only retry layer so every attempt takes a rate limit token
+    return AsyncOpenAI(api_key=API_KEY, http_client=openai_http_client, max_retries=0)# * set API key for OpenAI library
 
+TEMPERATURE = 0.5 # How creative GPT's answers are
+MAX_CACHEABLE_TEMPERATURE = 0.8 # Above this answers are meant to vary, so we don't cache them
+BATCH_CONCURRENCY = 20 # How many GPT requests from one batch can be running at the same time
+SYSTEM_PROMPT = "You are a helpful movie assistant."
 
-def chat_about_movie(movie_id, user_message):
+# Prompt template filled in by render_details_block, defined once here instead of rebuilding an f-string on every call
+DETAILS_TEMPLATE = """The user is asking about the movie '{title}'.
+Movie details:
+Title: {title}
+Overview: {overview}
+Release Date: {release_date}
+Rating: {vote_average}
+Genres: {genres}
+Runtime: {runtime} minutes
+Director: {directors}
+Cast: {cast}
+Similar movies: {similar}
+TMDB recommendations: {recommendations}
+
+Please answer the user's question based on these details,
+and if they ask for recommendations, use your movie knowledge.
+"""
+
+
+# ! Define a function that sends one request to GPT, taking a token from our shared rate limit first
+# * if OpenAI still answers 429 (rate limited), wait a random, growing amount of time (1s, 2s, 4s... up to 20s) and try again, up to 4 attempts
+@retry(
+    retry=retry_if_exception_type(RateLimitError),
+    wait=wait_random_exponential(min=1, max=20),
+    stop=stop_after_attempt(4),
+    reraise=True,
+)
+async def send_to_openai(**kwargs):
+    await acquire_token() # Take a token from the shared Redis bucket (raises RateLimitExceeded if none frees up in time)
+    return await get_client().chat.completions.create(**kwargs)
+
+
+# ! Define a function that sends a request to GPT while respecting our rate limits
+# * streaming answers don't use this, stream_chat_about_movie holds the semaphore itself until the whole answer has been read
+async def create_completion(**kwargs):
+    async with get_openai_semaphore(): # Wait for a free slot in this worker
+        return await send_to_openai(**kwargs)
+
+
+def chat_cache_key(movie_id, user_message):
+    # * normalize the question so small differences in case/spacing still hit the cache
+    question_hash = hashlib.sha256(user_message.strip().lower().encode()).hexdigest()
+    return f"gpt:{movie_id}:{question_hash}"
+
+
+def render_details_block(details):
+    """ DOCSTRING
+    Turn TMDB movie details into the block of text GPT uses as context.
+    """
+
+    # ! Step 1: Pull the extra info TMDB appended to the details (credits, similar movies, recommendations)
+    credits = details.get('credits', {})
+
+    # ! Step 2: Fill in the prompt template using the movie details
+    # * lists like genres are joined into plain text ("Drama, Thriller") instead of printing a Python list
+    return DETAILS_TEMPLATE.format(
+        title=details.get('title'),
+        overview=details.get('overview'),
+        release_date=details.get('release_date'),
+        vote_average=details.get('vote_average'),
+        genres=", ".join(genre['name'] for genre in details.get('genres', ())),
+        runtime=details.get('runtime'),
+        directors=", ".join(person['name'] for person in credits.get('crew', ()) if person.get('job') == 'Director'),
+        cast=", ".join(person['name'] for person in credits.get('cast', [])[:5]), # Top 5 billed actors
+        similar=", ".join(movie['title'] for movie in details.get('similar', {}).get('results', [])[:5]),
+        recommendations=", ".join(movie['title'] for movie in details.get('recommendations', {}).get('results', [])[:5]),
+    )
+
+
+async def store_details_block(movie_id, details, version=None):
+    """ DOCSTRING
+    Render the movie context block from `details` and cache it in Redis,
+    tagged with the version (TMDB ETag) of the details it was built from.
+    """
+
+    block = render_details_block(details)
+    await cache_set(f"gpt:details_block:{movie_id}", {"block": block, "version": version}, CACHE_TTL_DETAILS)
+    return block
+
+
+async def warm_details_block(movie_id, details, version=None):
+    """ DOCSTRING
+    Make sure the movie context block for `movie_id` is cached, only rendering
+    and storing it when there is none yet or it was built from another version.
+    """
+
+    cached = await cache_get(f"gpt:details_block:{movie_id}")
+    if isinstance(cached, dict) and cached.get("version") == version:
+        return # * already built from these exact details, nothing to do
+
+    await store_details_block(movie_id, details, version)
+
+
+async def get_details_block(movie_id, details_version=None):
+    """ DOCSTRING
+    Return the movie context block for `movie_id`, built once and then
+    reused from Redis. Returns None if the movie can't be found.
+    If `details_version` is given (the ETag the frontend got from /movie/<id>),
+    the cached block is only reused when it was built from that same version.
+    """
+
+    cached = await cache_get(f"gpt:details_block:{movie_id}")
+    if isinstance(cached, dict) and (details_version is None or cached.get("version") == details_version):
+        return cached["block"] # * the block already matches what the user is looking at, no need to load the movie details at all
+
+    # Fetch movie details from TMDB using the provided movie ID
+    details, _, version = await get_movie_details(movie_id)  # * using the get movie details function to fetch the movie details from TMDB using the provided movie ID
+    if not details:
+        return None
+
+    return await store_details_block(movie_id, details, version)
+
+
+def build_messages(details_block, user_message):
+    """ DOCSTRING
+    Build the list of chat messages sent to GPT for a question about a movie.
+    """
+
+    # * the movie details go in the system message so every question about the same movie starts with the exact same text,
+    # * OpenAI caches that shared beginning (prompt caching), which makes repeat questions cheaper and faster
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT + "\n" + details_block}, # Provide movie context
+        {"role": "user", "content": user_message}  # User's question about the movie
+    ]
+
+
+async def chat_about_movie(movie_id, user_message, no_cache=False, details_version=None):
     """ DOCSTRING
     Given a movie ID and user message, fetch TMDB details and 
     use GPT to respond naturally.
+    Pass no_cache=True to always ask GPT for a fresh answer.
+    Pass details_version (the ETag from /movie/<id>) to reuse the movie context already built for it.
+    If GPT fails but an older answer is cached, that answer is returned with "stale": True.
     """ 
 
-    # Fetch movie details from TMDB using the provided movie ID
-    details = get_movie_details(movie_id)  # * using the get movie details function to fetch the movie details from TMDB using the provided movie ID and if the details are not found, return an error message
-    if not details:
-        return {"error": "Movie details not found"} # Handle case where movie details are not found
-    
-    # ! Step 1: Create a prompt for GPT using the movie details
-    prompt = f"""
-    The user is asking about the movie '{details.get('title')}'. 
-    Movie details:
-    Title: {details.get('title')}
-    Overview: {details.get('overview')}
-    Release Date: {details.get('release_date')}
-    Rating: {details.get('vote_average')}
-    Genres: {[genre['name'] for genre in details.get('genres', [])]}
-    Runtime: {details.get('runtime')} minutes
+    # Return a cached answer if the same question was asked about this movie recently
+    use_cache = not no_cache and TEMPERATURE <= MAX_CACHEABLE_TEMPERATURE
+    key = chat_cache_key(movie_id, user_message)
+    entry = await cache_get_entry(key) if use_cache else None
+    if entry is not None and is_fresh(entry, CACHE_TTL_CHAT):
+        return {"response": entry["data"]}
+
+    try:
+        result = await ask_gpt(movie_id, user_message, key if use_cache else None, details_version)
+    except Exception:
+        # If GPT failed, fall back to an older answer to the same question if we have one
+        if entry is not None:
+            return {"response": entry["data"], "stale": True}
+        raise
+
+    # Same fallback when the movie details couldn't be fetched from TMDB
+    if "error" in result and entry is not None:
+        return {"response": entry["data"], "stale": True}
+
+    return result
+
 
-    Please answer the user's question based on these details, 
-    and if they ask for recommendations, use your movie knowledge.
+async def ask_gpt(movie_id, user_message, key=None, details_version=None):
+    """ DOCSTRING
+    Build the movie prompt, ask GPT and, if a cache key is given,
+    store the answer under it.
     """
 
+    # Get the movie context (from Redis, or built from TMDB details) using the provided movie ID
+    details_block = await get_details_block(movie_id, details_version)  # * if the movie details are not found, return an error message
+    if details_block is None:
+        return {"error": "Movie details not found"} # Handle case where movie details are not found
+    
     # ! Step 2: Send the prompt to GPT and get a response using the new API
-    response = client.chat.completions.create(
+    response = await create_completion(
         model="gpt-4o-mini", # * Use the GPT-4o-mini model for generating responses
-        messages=[
-            {"role": "system", "content": "You are a helpful movie assistant."}, 
-            {"role": "user", "content": prompt},  # Provide movie context
-            {"role": "user", "content": user_message}  # User's question about the movie
-        ],
-        temperature=0.5,  # Set temperature for response creativity
+        messages=build_messages(details_block, user_message),
+        temperature=TEMPERATURE,  # Set temperature for response creativity
     )
 
-    return {"response": response.choices[0].message.content} # Extract the content of the response
+    answer = response.choices[0].message.content # Extract the content of the response
+
+    # Save the answer so the next identical question about this movie is instant and free
+    if key is not None:
+        await cache_set_entry(key, answer)
+
+    return {"response": answer}
     # * Return the response content from GPT, which contains the answer to the user's question about the movie
+
+
+async def stream_chat_about_movie(movie_id, user_message, no_cache=False, details_version=None):
+    """ DOCSTRING
+    Same as chat_about_movie, but yields GPT's answer piece by piece
+    while it is being generated instead of waiting for the whole answer.
+    Each piece is {"delta": text}, an older cached answer sent because
+    TMDB or GPT failed is marked with "stale": True.
+    """
+
+    # Send the cached answer in one piece if the same question was asked about this movie recently
+    use_cache = not no_cache and TEMPERATURE <= MAX_CACHEABLE_TEMPERATURE
+    key = chat_cache_key(movie_id, user_message)
+    entry = await cache_get_entry(key) if use_cache else None
+    if entry is not None and is_fresh(entry, CACHE_TTL_CHAT):
+        yield {"delta": entry["data"]}
+        return
+
+    # Get the movie context (from Redis, or built from TMDB details) using the provided movie ID
+    details_block = await get_details_block(movie_id, details_version)
+    if details_block is None:
+        if entry is not None:
+            yield {"delta": entry["data"], "stale": True} # Fall back to an older answer if TMDB is down
+            return
+        raise LookupError("Movie details not found")
+
+    # * hold a slot in this worker for the whole answer, not just until the stream starts, the semaphore size assumes a slot lasts the full request
+    async with get_openai_semaphore():
+        # ! Step 1: Ask GPT to stream its answer back as it writes it
+        try:
+            stream = await send_to_openai(
+                model="gpt-4o-mini", # * Use the GPT-4o-mini model for generating responses
+                messages=build_messages(details_block, user_message),
+                temperature=TEMPERATURE,  # Set temperature for response creativity
+                stream=True, # * GPT sends small chunks of text as soon as they are ready
+            )
+        except Exception:
+            if entry is not None:
+                yield {"delta": entry["data"], "stale": True} # Fall back to an older answer if GPT is down
+                return
+            raise
+
+        # ! Step 2: Pass every piece of text on as soon as it arrives, keeping a copy to cache the full answer
+        parts = []
+        async for chunk in stream:
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if text:
+                parts.append(text)
+                yield {"delta": text}
+
+    # ! Step 3: Save the full answer so the next identical question is instant (an empty answer isn't worth replaying)
+    if use_cache and parts:
+        await cache_set_entry(key, "".join(parts))
+
+
+async def chat_about_movies_batch(items, no_cache=False):
+    """ DOCSTRING
+    Given a list of {"movie_id", "user_message"} items, answer all of them
+    concurrently and return the results in the same order.
+    """
+
+    # ! Step 1: Limit how many requests run at once so a big batch doesn't flood OpenAI
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    # ! Step 2: Answer a single item, turning any failure into an error entry so one bad item doesn't fail the whole batch
+    async def one(item):
+        async with semaphore:
+            try:
+                return await chat_about_movie(item["movie_id"], item["user_message"], no_cache=no_cache, details_version=item.get("details_version"))
+            except Exception as e:
+                return {"error": str(e)}
+
+    # ! Step 3: Run every item at the same time and wait for all of them to finish
+    return await asyncio.gather(*(one(item) for item in items))
@@ -0,0 +1,18 @@
+import os
+import multiprocessing
+
+# this is the gunicorn.conf.py file that gunicorn reads automatically when started from the backend folder
+# run the production server with: gunicorn main:app
+
+# ! Step 1: Listen on the port the host gives us (Render sets PORT), default to 5000 locally
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# ! Step 2: Use uvicorn workers so our async Quart routes run on an event loop and each worker handles many requests at once
+worker_class = "uvicorn_worker.UvicornWorker" # * from the uvicorn-worker package, uvicorn's own uvicorn.workers module is deprecated
+
+# ! Step 3: Number of worker processes (defaults to 2 x CPU cores, can be changed with WEB_CONCURRENCY)
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2))
+os.environ["WEB_CONCURRENCY"] = str(workers) # * workers inherit this, rate_limiter.py uses it to split the OpenAI concurrency budget between them
+
+# ! Step 4: Give slow GPT answers time to finish before a worker is considered stuck
+timeout = 120
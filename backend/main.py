@@ -1,25 +1,78 @@
-from flask_cors import CORS
+from quart_cors import cors
 import os # Import necessary modules
-from flask import Flask, request, jsonify  # Import Flask core and helper functions  
-from movie_service import search_movie, get_movie_details  # Import movie logic from separate file
-from gpt_service import chat_about_movie # Import GPT chat logic from separate file
+import orjson # Fast JSON library used to build every JSON response
+import gzip # To compress responses before sending them to the browser
+import brotli # Better compression than gzip, used when the browser supports it
+from quart import Quart, request, jsonify  # Import Quart core and helper functions (Quart is the async version of Flask, same API)
+from quart.json.provider import DefaultJSONProvider # Quart's JSON handling, we swap in orjson below
+from movie_service import search_movie, get_movie_details, tmdb_client  # Import movie logic from separate file
+from gpt_service import chat_about_movie, chat_about_movies_batch, stream_chat_about_movie, warm_details_block, get_client as get_openai_client # Import GPT chat logic from separate file
 import openai  # Add OpenAI import for new API
-
-# ! Step 1: Define the Flask application instance
-app = Flask(__name__)
-CORS(app)
+from rate_limiter import RateLimitExceeded # Raised when too many GPT requests are waiting for OpenAI
+
+# ! Step 0: Make jsonify and request.get_json use orjson instead of the built-in json module
+class OrjsonProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode() # * orjson gives bytes, Quart expects a string here
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+# ! Step 1: Define the Quart application instance
+app = Quart(__name__)
+app.json = OrjsonProvider(app)
+app = cors(app, allow_origin="*", expose_headers=["ETag"]) # * exposing ETag lets the frontend read the movie details version (see /movie/<id>)
+
+# ! Step 1.0: Compression settings for responses sent to the browser
+app.config["COMPRESS_MIMETYPES"] = ["application/json"] # Only compress JSON (streams and other responses are sent as they are)
+app.config["COMPRESS_LEVEL"] = 5 # Good balance between CPU time and size
+app.config["COMPRESS_MIN_SIZE"] = 500 # Tiny responses aren't worth compressing
+
+# ! Step 1.0.1: Compress every JSON response with brotli or gzip, depending on what the browser accepts
+@app.after_request
+async def compress_response(response):
+    if (
+        response.mimetype not in app.config["COMPRESS_MIMETYPES"]
+        or "Content-Encoding" in response.headers
+        or response.status_code < 200
+        or response.status_code == 204
+    ):
+        return response
+
+    data = await response.get_data()
+    if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+        return response
+
+    # * pick brotli if the browser supports it, otherwise gzip, otherwise send it uncompressed
+    level = app.config["COMPRESS_LEVEL"]
+    if request.accept_encodings.quality("br") > 0:
+        response.set_data(brotli.compress(data, quality=level))
+        response.headers["Content-Encoding"] = "br"
+    elif request.accept_encodings.quality("gzip") > 0:
+        response.set_data(gzip.compress(data, compresslevel=level))
+        response.headers["Content-Encoding"] = "gzip"
+
+    response.vary.add("Accept-Encoding") # Tell caches that the body depends on the Accept-Encoding header
+    return response
+
+# ! Step 1.1: Define a helper that marks a response as coming from an older cache entry
+# * used when TMDB/OpenAI is slow or down and we answer with data we cached earlier instead of an error
+def with_stale_warning(response, stale):
+    if stale:
+        response.headers["Warning"] = '110 - "Response is Stale"'
+    return response
 
 # ! Step 2: Define the root endpoint for the base URL
 @app.route("/")  # When someone visits the base URL, this function will run
 
 # ! Step 3: Define the root function
-def root(): 
+async def root(): 
     # ! Step 4: Return a JSON message confirming the backend is running
     return jsonify({"message": "Backend is running!"})
 
                 # * MOVIE DETAILS ENDPOINT search movie endpoint
 @app.route("/search_movie") 
-def search_movie_route():  
+async def search_movie_route():  
     # ! Step 3: Get the "query" parameter from the URL (search term)
     query = request.args.get("query", "").strip()  
 
@@ -28,36 +81,45 @@ def search_movie_route():
         return jsonify({"error": "Query parameter is required"}), 400
 
     # Call the movie_service function to get search results
-    results = search_movie(query)  
+    results, stale, _ = await search_movie(query)  
 
     # ! Step 5: If TMDB API call failed, return an error with status 500
     if results is None: 
         return jsonify({"error": "Failed to fetch data from TMDB"}), 500
 
     # ! Step 6: Return the filtered movie data as a JSON response to the frontend
-    return jsonify({"results": results}) 
+    return with_stale_warning(jsonify({"results": results}), stale) 
 
                 # * MOVIE DETAILS ENDPOINT movie details endpoint
 @app.route("/movie/<int:movie_id>")  
-def movie_details_route(movie_id): 
-    details = get_movie_details(movie_id)  
+async def movie_details_route(movie_id): 
+    details, stale, version = await get_movie_details(movie_id)  
 
     # ! Step 2: If TMDB API call failed, return an error with status 500
     if details is None:
         return jsonify({"error": "Failed to fetch movie details from TMDB"}), 500
 
-    # ! Step 3: Return the movie details as json
-    return jsonify(details) 
+    # ! Step 2.1: Build the GPT movie context now (if it isn't cached for this version yet), in the background, so the user's first chat question about this movie doesn't have to
+    app.add_background_task(warm_details_block, movie_id, details, version)
+
+    # ! Step 3: Return the movie details as json, with their version in the ETag header
+    # * the frontend sends this version back as details_version when chatting, so /chat can reuse the context built above
+    response = with_stale_warning(jsonify(details), stale)
+    if version:
+        response.headers["ETag"] = version
+    return response 
 
                # * GPT CHAT ENDPOINT chat about movie endpoint
 @app.route("/chat", methods=["POST"]) 
-def chat_route():  
+async def chat_route():  
     # ! Step 1: Get JSON data sent by frontend
-    data = request.get_json()  
+    data = await request.get_json()  
 
     # ! Step 2: Extract what we need from that data.
     movie_id = data.get("movie_id")  
     user_message = data.get("user_message") 
+    no_cache = bool(data.get("no_cache")) or request.args.get("no_cache") == "true" # Lets the caller skip the cached answer and get a fresh one
+    details_version = data.get("details_version") # Optional ETag from /movie/<id>, lets us skip reloading the movie details
 
     # ! Step 3: Validate that both movie_id and user_message are present
     if not movie_id or not user_message:
@@ -65,14 +127,96 @@ def chat_route():
 
     # ! Step 4: Use gpt_service.py to get a GPT response about the movie
     try:
-        result = chat_about_movie(movie_id, user_message)  # Call the helper function
-        return jsonify(result)  # Return the GPT response as JSON
+        result = await chat_about_movie(movie_id, user_message, no_cache=no_cache, details_version=details_version)  # Call the helper function
+        stale = result.pop("stale", False)
+        return with_stale_warning(jsonify(result), stale)  # Return the GPT response as JSON
+    except (RateLimitExceeded, openai.RateLimitError):
+        # ! Step 4.1: We (or OpenAI) are over the rate limit, tell the client to retry later instead of a generic 500
+        return jsonify({"error": "Too many requests right now, please try again in a moment"}), 429, {"Retry-After": "5"}
     except Exception as e:
         # ! Step 5: Handle any errors 
         return jsonify({"error": str(e)}), 500
 
-# ! Step FINALE: Run the Flask app in debug mode if this script is executed directly
+               # * GPT STREAMING CHAT ENDPOINT sends the answer as Server-Sent Events while GPT writes it
+# ! Step 1: Define a helper that formats one Server-Sent Event
+def sse_event(data, event=None):
+    message = f"data: {orjson.dumps(data).decode()}\n\n" # * each event is "data: <json>" followed by a blank line
+    if event:
+        message = f"event: {event}\n" + message
+    return message.encode()
+
+@app.route("/chat_stream", methods=["POST"])
+async def chat_stream_route():
+    # ! Step 2: Get and validate the JSON data sent by frontend (same shape as /chat)
+    data = await request.get_json()
+    if not isinstance(data, dict):
+        data = {} # * anything that isn't a JSON object is treated as missing fields, so it gets the 400 below
+    movie_id = data.get("movie_id")
+    user_message = data.get("user_message")
+    no_cache = bool(data.get("no_cache")) or request.args.get("no_cache") == "true" # Lets the caller skip the cached answer and get a fresh one
+    details_version = data.get("details_version")
+
+    if not movie_id or not user_message:
+        return jsonify({"error": "movie_id and user_message are required"}), 400
+
+    # ! Step 3: Wait for the first piece of the answer before sending any headers
+    # * this is where the rate limit, TMDB and the connection to GPT are checked, so failures here still get a proper status code like /chat
+    pieces = stream_chat_about_movie(movie_id, user_message, no_cache=no_cache, details_version=details_version)
+    try:
+        first_piece = await pieces.__anext__()
+    except StopAsyncIteration:
+        first_piece = None # GPT sent back an empty answer
+    except (RateLimitExceeded, openai.RateLimitError):
+        return jsonify({"error": "Too many requests right now, please try again in a moment"}), 429, {"Retry-After": "5"}
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    # ! Step 4: Send each piece of the answer as {"delta": "..."} (with "stale": true if it's an older cached answer), then a "done" event (or an "error" event if something failed)
+    async def event_stream():
+        try:
+            if first_piece is not None:
+                yield sse_event(first_piece)
+                async for piece in pieces:
+                    yield sse_event(piece)
+            yield sse_event({}, event="done")
+        except Exception as e:
+            yield sse_event({"error": str(e)}, event="error")
+
+    # * X-Accel-Buffering stops proxies from holding the stream back until it's finished
+    return event_stream(), 200, {"Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+               # * GPT BATCH CHAT ENDPOINT answer many questions in one request
+MAX_BATCH_SIZE = 50 # Biggest batch we accept in one request
+
+@app.route("/chat_batch", methods=["POST"])
+async def chat_batch_route():
+    # ! Step 1: Get JSON data sent by the caller, expected shape: {"items": [{"movie_id": ..., "user_message": ...}, ...]}
+    data = await request.get_json()
+    items = data.get("items") if isinstance(data, dict) else None # * the body must be a JSON object, anything else (e.g. a bare list) is rejected below
+
+    # ! Step 2: Validate the list of items
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "items must be a non-empty list"}), 400
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"items can contain at most {MAX_BATCH_SIZE} entries"}), 400
+    if not all(isinstance(item, dict) and item.get("movie_id") and item.get("user_message") for item in items):
+        return jsonify({"error": "every item needs a movie_id and user_message"}), 400
+
+    # ! Step 3: Answer every item concurrently and return the results in the same order
+    results = await chat_about_movies_batch(items, no_cache=bool(data.get("no_cache")))
+    return jsonify({"results": results})
+
+# ! Step 6: Close the shared TMDB connections cleanly when the server shuts down
+@app.after_serving
+async def close_clients():
+    await tmdb_client.aclose()
+    if get_openai_client.cache_info().currsize: # Only close the OpenAI client if it was ever created
+        await get_openai_client().close()
+
+# ! Step FINALE: Run the Quart development server if this script is executed directly
+# * in production run `gunicorn main:app` instead (see gunicorn.conf.py), this dev server only handles one thing at a time
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))  # use Render's assigned port
-    app.run(host="0.0.0.0", port=port, debug=True)
+    debug = os.environ.get("DEBUG", "false").lower() == "true"  # Debug mode is off unless DEBUG=true is set
+    app.run(host="0.0.0.0", port=port, debug=debug)
@@ -1,6 +1,11 @@
 
 import os
-import requests  # To make HTTP requests to external APIs (TMDB)
+import asyncio # To wait between retries without blocking other requests
+import httpx  # To make async HTTP requests to external APIs (TMDB)
+import orjson # Fast JSON library, parses TMDB responses several times faster than the built-in json module
+import msgspec # Parses JSON straight into typed objects, skipping any field we don't ask for
+from typing import List, Optional
+from cache import cached_fetch, NOT_MODIFIED, CACHE_TTL_DETAILS, CACHE_TTL_SEARCH # Redis cache helpers so we don't call TMDB for data we already have
 
 # this is the movie_service.py file that contains the logic for interacting with the TMDB API
 
@@ -8,59 +13,154 @@ import requests  # To make HTTP requests to external APIs (TMDB)
 TMDB_API_KEY = os.getenv("TMDB_API_KEY") # Replace with your actual TMDB API key
 TMDB_BASE_URL = "https://api.themoviedb.org/3" # Base URL for TMDB API
 
+# ! Step 1.0: Create one HTTP client that is shared by every request to TMDB
+# * reusing the same client keeps connections to TMDB open (keep-alive), so we don't pay for a new TCP + TLS handshake on every call
+tmdb_client = httpx.AsyncClient(
+    base_url=TMDB_BASE_URL, # every request below only needs the path, e.g. "/search/movie"
+    params={"api_key": TMDB_API_KEY}, # TMDB API key is sent with every request so the API knows who is making it
+    timeout=10, # Give up on TMDB after 10 seconds instead of hanging forever
+    # * when we pass our own transport httpx ignores the client's limits, so the pool size has to be set on the transport itself
+    transport=httpx.AsyncHTTPTransport(
+        retries=3, # Retry up to 3 times if the connection to TMDB can't be made
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50), # How many connections to TMDB we keep open at once
+    ),
+    headers={"Accept-Encoding": "gzip, br"}, # Ask TMDB for compressed JSON, httpx unpacks it for us (br needs the brotli package)
+)
+
+# ! Step 1.0.0: How many actors / similar movies / recommendations we keep from the appended sections
+APPENDED_LIMIT = 5
+
+# ! Step 1.0.1: Status codes that mean "TMDB is busy or having a moment", worth trying again
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+# ! Step 1.0.2: Define a helper that makes a GET request to TMDB and retries with backoff on temporary failures
+async def tmdb_get(url, params=None, headers=None, retries=3, backoff_factor=0.2):
+    for attempt in range(retries + 1):
+        response = await tmdb_client.get(url, params=params, headers=headers)
+
+        # * return right away if the request worked, failed for good, or we ran out of retries
+        if response.status_code not in RETRY_STATUSES or attempt == retries:
+            return response
+
+        await asyncio.sleep(backoff_factor * (2 ** attempt)) # Wait 0.2s, 0.4s, 0.8s... before trying again
+
+
+# ! Step 1.0.3: Define a helper that builds the headers for a conditional request
+# * with If-None-Match TMDB answers "304 Not Modified" (a few hundred bytes) instead of the full JSON when our cached copy is still current
+def conditional_headers(etag):
+    return {"If-None-Match": etag} if etag else None
+
+
+# ! Step 1.0.4: Describe the only parts of a TMDB search response we care about
+# * msgspec skips every other field (adult, backdrop_path, genre_ids, popularity...) while parsing, so they are never turned into Python objects
+class MovieHit(msgspec.Struct):
+    id: int # Movie unique ID
+    title: str # Movie title
+    overview: Optional[str] = "" # Movie description or empty string if missing
+    poster_path: Optional[str] = "" # Poster image path or empty string
+    release_date: Optional[str] = "" # Release date or empty string
+    vote_average: float = 0.0 # Average vote or 0 if missing
+
+
+class SearchResponse(msgspec.Struct):
+    results: List[MovieHit] = [] # The list depends on the search query and may be empty
+
 
 # ! Step 1.1: Define a function to search for movies by title
-def search_movie(query):
-    # ! Step 2: Build the URL to call the TMDB API with your API key and the search query
-    url = f"{TMDB_BASE_URL}/search/movie" # * this is telling the TMDB API that we want to search for movies when we call this endpoint(meaning the URL)
+# * returns (results, stale, etag), stale is True when the results come from an older cache entry, etag is TMDB's version tag for them
+async def search_movie(query):
+    # ! Step 1.2: Return cached results if someone searched for the same thing recently, otherwise ask TMDB
+    key = f"tmdb:search:{query.strip().lower()}" # * normalize the query so "Matrix" and " matrix" share the same cache entry
+    return await cached_fetch(key, CACHE_TTL_SEARCH, lambda etag: fetch_search_results(query, etag))
 
-    params = { # * this is telling the TMDB API what parameters we want to send with the request, parameters are basically the data we want to send to the API for example, the API key and the search query
-        "api_key": TMDB_API_KEY,  # TMDB API key so the API knows who is making the request
+
+# ! Step 1.3: Define a function that actually calls TMDB for a search
+# * returns (results, etag), (NOT_MODIFIED, etag) if TMDB says our cached copy is still current, or None if it failed
+async def fetch_search_results(query, etag=None):
+    # ! Step 2: Build the path to call the TMDB API with the search query (the API key is added by tmdb_client)
+    url = "/search/movie" # * this is telling the TMDB API that we want to search for movies when we call this endpoint(meaning the URL)
+
+    params = { # * this is telling the TMDB API what parameters we want to send with the request, parameters are basically the data we want to send to the API for example, the search query
         "query": query # The search query for the movie title
     }
 
     # ! Step 2.1: Make an HTTP GET request to the TMDB API
-    response = requests.get(url, params=params) # * this is making the actual request to the TMDB API with the URL and parameters we defined above and is activated when the function is called and the function is called when the user searches for a movie title
+    try:
+        response = await tmdb_get(url, params=params, headers=conditional_headers(etag)) # * this is making the actual request to the TMDB API with the URL and parameters we defined above, await lets the server handle other requests while we wait for TMDB
+    except httpx.HTTPError:
+        return None # Network problem or timeout talking to TMDB, handled later just like a failed response
+
+    # ! Step 2.2: TMDB says the results haven't changed since we cached them, no body to download
+    if response.status_code == 304:
+        return NOT_MODIFIED, etag
 
     # ! Step 2.3: If the response from TMDB is not OK (status code 200), return None (handled later)
     if response.status_code != 200: # * this checks if the response status code is not 200, which means the request was not successful
         return None # If the request was not successful, return None
 
-    # ! Step 2.4: Parse the TMDB JSON response into a Python dictionary
-    data = response.json() # * this converts the JSON response from the TMDB API into a Python dictionary so we can work with it easily
+    # ! Step 2.4: Parse the TMDB JSON response, keeping only the necessary movie details
+    try:
+        data = msgspec.json.decode(response.content, type=SearchResponse) # * this converts the JSON response into a SearchResponse, dropping the fields we don't need as it goes
+    except msgspec.DecodeError:
+        return None # TMDB sent something we couldn't parse, treat it like a failed request
 
-    # ! Step 2.5: Extract only the necessary movie details from TMDB data
-    results = [ # * this is creating a list of dictionaries with only the necessary movie details we want to return
-        {
-            "id": movie["id"],  # Movie unique ID
-            "title": movie["title"],  # Movie title
-             # * we start using .get because these details may not be guarenteed to exist in the TMDB response, so we use .get to avoid KeyError if they are missing
-            "overview": movie.get("overview", ""),  # Movie description or empty string if missing
-            "poster_path": movie.get("poster_path", ""),  # Poster image path or empty string
-            "release_date": movie.get("release_date", ""),  # Release date or empty string
-            "vote_average": movie.get("vote_average", 0)  # Average vote or 0 if missing
-        }
-        for movie in data.get("results", [])  # Loop over the list of movies from TMDB response safely. the list depends on the search query and may be empty
-    ]
+    # ! Step 2.5: Turn the movie hits into plain dictionaries so they can be cached and sent to the frontend
+    results = msgspec.to_builtins(data.results) # * this is creating a list of dictionaries with only the necessary movie details we want to return
 
-    return results # * Return the list of movie details
+    return results, response.headers.get("ETag") # * Return the list of movie details and TMDB's version tag for them
 
 
 # ! Step 2: Define a function to get movie details by ID
-def get_movie_details(movie_id):
-    # ! Step 3: Build the URL to call the TMDB API for movie details using the provided movie ID
-    url = f"{TMDB_BASE_URL}/movie/{movie_id}" # * this is telling the TMDB API that we want to get details of a specific movie when we call this endpoint using the movie ID
+# * returns (details, stale, etag), stale is True when the details come from an older cache entry, etag is TMDB's version tag for them
+async def get_movie_details(movie_id):
+    # ! Step 2.1: Return the cached movie details if we fetched this movie recently, otherwise ask TMDB
+    key = f"tmdb:movie:{movie_id}" # * every movie gets its own key in Redis
+    return await cached_fetch(key, CACHE_TTL_DETAILS, lambda etag: fetch_movie_details(movie_id, etag))
 
-    params = { # * this is telling the TMDB API what parameters we want to send with the request, parameters are basically the data we want to send to the API for example, the API key
-        "api_key": TMDB_API_KEY # TMDB API key so the API knows who is making the request
+
+# ! Step 2.2: Define a function that actually calls TMDB for movie details
+# * returns (details, etag), (NOT_MODIFIED, etag) if TMDB says our cached copy is still current, or None if it failed
+async def fetch_movie_details(movie_id, etag=None):
+    # ! Step 3: Build the path to call the TMDB API for movie details using the provided movie ID
+    url = f"/movie/{movie_id}" # * this is telling the TMDB API that we want to get details of a specific movie when we call this endpoint using the movie ID
+
+    params = { # * append_to_response makes TMDB include the cast/crew, similar movies and recommendations in this same response, one round trip instead of four
+        "append_to_response": "credits,similar,recommendations"
     }
 
     # ! Step 3.1: Make an HTTP GET request to the TMDB API for movie details
-    response = requests.get(url, params=params) # * this is making the actual request to the TMDB API with the URL and parameters we defined above and is activated when the function is called and the function is called when the user requests movie details by ID
+    try:
+        response = await tmdb_get(url, params=params, headers=conditional_headers(etag)) # * this is making the actual request to the TMDB API, the API key is already attached by tmdb_client
+    except httpx.HTTPError:
+        return None # Network problem or timeout talking to TMDB
+
+    # ! Step 3.1.1: TMDB says the details haven't changed since we cached them, no body to download
+    if response.status_code == 304:
+        return NOT_MODIFIED, etag
 
     # ! Step 3.2: If the response from TMDB is not OK (status code 200), return None
     if response.status_code != 200: # * this checks if the response status code is not 200, which means the request was not successful
         return None # If the request was not successful, return None
 
-    # ! Step 3.3: Parse the TMDB JSON response into a Python dictionary and return the movie details
-    return response.json() # * this converts the JSON response from the TMDB API into a Python dictionary so we can work with it easily and returns the movie details
+    # ! Step 3.3: Parse the TMDB JSON response into a Python dictionary
+    data = orjson.loads(response.content) # * this converts the JSON response from the TMDB API into a Python dictionary so we can work with it easily
+
+    # ! Step 3.4: Trim the appended sections and return the movie details with TMDB's version tag
+    return trim_appended_details(data), response.headers.get("ETag")
+
+
+# ! Step 4: Define a function that shrinks the appended credits/similar/recommendations to what the GPT prompt uses
+# * the full cast & crew and the related movie lists are big, and we would otherwise cache them for days and send them to the browser on every /movie/<id>
+def trim_appended_details(data):
+    credits = data.get("credits") or {}
+    data["credits"] = {
+        "cast": [{"name": person["name"]} for person in credits.get("cast", [])[:APPENDED_LIMIT]], # Top billed actors
+        "crew": [{"name": person["name"], "job": person["job"]} for person in credits.get("crew", []) if person.get("job") == "Director"], # Only the director(s)
+    }
+
+    for section in ("similar", "recommendations"):
+        results = (data.get(section) or {}).get("results", [])
+        data[section] = {"results": [{"id": movie["id"], "title": movie["title"]} for movie in results[:APPENDED_LIMIT]]}
+
+    return data
@@ -0,0 +1,80 @@
+import os
+import time
+import asyncio # To wait for a free slot without blocking other requests
+import redis  # For the RedisError exception
+from cache import r # Reuse the shared Redis client from cache.py
+
+# this is the rate_limiter.py file that keeps our OpenAI usage under the account's requests-per-minute limit,
+# * the bucket lives in Redis so every worker process shares the same budget
+
+# ! Step 1: Read the limits from the environment
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", 500)) # Requests per minute our OpenAI account allows
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 50)) # Most GPT requests the whole app (all workers together) may have running at once
+OPENAI_AVG_LATENCY = float(os.getenv("OPENAI_AVG_LATENCY", 3)) # Roughly how many seconds a GPT answer takes
+RATE_LIMIT_WAIT = float(os.getenv("RATE_LIMIT_WAIT", 5)) # How long a request may wait for a free slot before we give up
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1)) # Number of worker processes sharing the budget (set by gunicorn.conf.py, 1 for the dev server)
+
+# ! Step 1.1: Limit how many GPT requests run at the same time in this worker
+# * no point running more at once than the RPM limit can sustain: requests per second x seconds per request,
+# * that budget is for the whole account, so each worker process gets its share of it
+OPENAI_WORKER_CONCURRENCY = max(1, min(OPENAI_MAX_CONCURRENCY, int(OPENAI_RPM / 60 * OPENAI_AVG_LATENCY)) // WEB_CONCURRENCY)
+openai_semaphore = None # Created on first use, see get_openai_semaphore
+
+
+# ! Step 1.2: Define a function that returns this worker's semaphore, creating it the first time
+# * it has to be created inside the running event loop: on Python 3.9 a semaphore made at import time is tied to a different loop than the one the server runs on
+def get_openai_semaphore():
+    global openai_semaphore
+    if openai_semaphore is None:
+        openai_semaphore = asyncio.Semaphore(OPENAI_WORKER_CONCURRENCY)
+    return openai_semaphore
+
+# ! Step 2: Token bucket written in Lua so Redis runs the whole check-and-take as one atomic step
+# * the bucket refills at `rate` tokens per second up to `capacity`, every request takes one token
+TOKEN_BUCKET_SCRIPT = """
+local key = KEYS[1]
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+
+local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+
+redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+return allowed
+"""
+token_bucket = r.register_script(TOKEN_BUCKET_SCRIPT)
+
+
+# ! Step 3: Define the error raised when we couldn't get a slot in time (the routes turn it into a 429)
+class RateLimitExceeded(Exception):
+    pass
+
+
+# ! Step 4: Define a function that takes one token from the bucket, waiting a little if it is empty
+async def acquire_token(key="ratelimit:openai", rpm=OPENAI_RPM, wait=RATE_LIMIT_WAIT):
+    rate = rpm / 60 # tokens added per second
+    deadline = time.monotonic() + wait
+
+    while True:
+        try:
+            allowed = await token_bucket(keys=[key], args=[rate, rpm, time.time()])
+        except redis.RedisError:
+            return # If Redis is down we can't count, so let the request through rather than failing it
+
+        if allowed:
+            return
+
+        if time.monotonic() >= deadline:
+            raise RateLimitExceeded("Too many requests right now, please try again in a moment")
+
+        await asyncio.sleep(1 / rate) # * about the time it takes for the next token to be added
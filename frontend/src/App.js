@@ -46,6 +46,10 @@ function App() {
   const [chatMessage, setChatMessage] = useState(""); 
   const [chatResponse, setChatResponse] = useState(""); 
 
+  // ! Step 5: Create a state variable for the version (ETag) of the selected movie's details
+  // Why: We send it back with chat messages so the backend can reuse the movie info it already prepared instead of loading it again.
+  const [detailsVersion, setDetailsVersion] = useState(null);
+
   // ! BASE URL for backend requests
   // ? In development, this can be localhost, but in Vercel production, it should be the deployed API endpoint
   const BASE_URL = "https://c-nebot.onrender.com";
@@ -97,6 +101,9 @@ function App() {
 
       // Save this movie’s details into state so we can display them
       setSelectedMovie(data || null);
+
+      // Remember which version of the details we got (null if the backend didn't send one)
+      setDetailsVersion(response.headers.get("ETag"));
     } catch (error) {
       console.error("Error fetching movie details:", error);
       setSelectedMovie(null);
@@ -119,13 +126,17 @@ function App() {
         return;
       }
 
-      // * 3. Send POST request to backend with movie ID and user message
-      const response = await fetch(`${BASE_URL}/chat`, {
+      // * 3. Send POST request to the streaming chat endpoint with movie ID and user message
+      // ? Why streaming: the backend sends GPT's answer piece by piece (Server-Sent Events) as it is written,
+      //      so the reply starts showing up almost instantly instead of after the whole answer is ready.
+      //      We read it with fetch instead of EventSource because EventSource can only make GET requests.
+      const response = await fetch(`${BASE_URL}/chat_stream`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({
           movie_id: selectedMovie.id,
-          user_message: chatMessage
+          user_message: chatMessage,
+          details_version: detailsVersion
         }),
       });
 
@@ -137,28 +148,45 @@ function App() {
         return;
       }
 
-      // 5. Try to parse JSON safely
-      let data;
-      try {
-        data = await response.json();
-      } catch {
-        // If not JSON, fallback to raw text
-        const text = await response.text();
-        setChatResponse(text || "No response from backend");
-        return;
+      // 5. Read the stream chunk by chunk and add each piece of text to the reply as it arrives
+      // * Each event looks like: "data: {"delta": "some text"}" followed by a blank line.
+      //   The last event is "event: done", or "event: error" with {"error": "..."} if something failed.
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = ""; // Holds a partial event until the rest of it arrives
+      let reply = "";
+      setChatResponse("");
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split("\n\n");
+        buffer = events.pop(); // The last piece may be incomplete, keep it for the next chunk
+
+        for (const rawEvent of events) {
+          const eventLine = rawEvent.split("\n").find((line) => line.startsWith("event: "));
+          const dataLine = rawEvent.split("\n").find((line) => line.startsWith("data: "));
+          if (!dataLine) continue;
+
+          const data = JSON.parse(dataLine.slice("data: ".length));
+          const eventType = eventLine ? eventLine.slice("event: ".length) : "message";
+
+          if (eventType === "error") {
+            setChatResponse(`Error: ${data.error}`);
+            return;
+          }
+          if (data.delta) {
+            reply += data.delta;
+            setChatResponse(reply);
+          }
+        }
       }
 
-      // ! CHANGE MADE HERE: More flexible handling of backend response formats
-      // ? Why: Sometimes backend might return { reply: "..."} or { response: "..."} or even a plain string.
-      //        This ensures we always show a clean, readable message instead of raw JSON or keys.
-      // * Logic:
-      // - If reply exists, show it.
-      // - Else if response exists, show that.
-      // - Else if it's a string, show it.
-      // - Else fallback to stringified JSON.
-      setChatResponse(
-        data.reply || data.response || (typeof data === "string" ? data : JSON.stringify(data))
-      );
+      if (!reply) {
+        setChatResponse("No response from backend");
+      }
 
     } catch (error) {
       // If there’s a network error or unexpected problem, log and show message